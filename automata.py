@@ -5,34 +5,57 @@
 # Contact: andrewbadr@gmail.com
 # Code contributions are welcome.
 
+import bisect
+from array import array
 from copy import copy
 
 class UnionFind():
-    """Implements a Union-Find (or discrete-set) data-structure with the following performance profile:
+    """Implements a Union-Find (or disjoint-set) data-structure, as a forest with union
+    by rank and path compression, with the following performance profile:
     -makeset O(1)
-    -find O(1)
-    -union O(n)
+    -find O(alpha(n)) amortized
+    -union O(alpha(n)) amortized
+    where alpha is the inverse Ackermann function.
     """
     def __init__(self):
-        self.sets = []
-        self.lookup = {}
+        self.parent = {}
+        self.rank = {}
+        self.items = []
     def make_set(self, item):
-        new_set = [item]
-        self.sets.append(new_set)
-        self.lookup[item] = new_set
+        self.parent[item] = item
+        self.rank[item] = 0
+        self.items.append(item)
     def find(self, item):
-        return self.lookup[item]
-    def union(self, set1, set2):
-        """Merges set1 into set2"""
-        assert(set1 in self.sets)
-        assert(set2 in self.sets)
-        for (item, value) in self.lookup.iteritems():
-            if value == set1:
-                self.lookup[item] = set2
-        self.sets.remove(set1)
-        set2.extend(set1)
+        """Returns the representative item of the set containing item."""
+        root = item
+        while self.parent[root] != root:
+            root = self.parent[root]
+        while self.parent[item] != root:
+            (self.parent[item], item) = (root, self.parent[item])
+        return root
+    def union(self, item1, item2):
+        """Merges the sets containing item1 and item2, and returns the representative
+        of the resulting set."""
+        root1, root2 = self.find(item1), self.find(item2)
+        if root1 == root2:
+            return root1
+        if self.rank[root1] > self.rank[root2]:
+            (root1, root2) = (root2, root1)
+        self.parent[root1] = root2
+        if self.rank[root1] == self.rank[root2]:
+            self.rank[root2] += 1
+        return root2
     def as_lists(self):
-        return self.sets
+        """Returns the sets as lists, items being in their order of creation."""
+        sets = {}
+        lists = []
+        for item in self.items:
+            root = self.find(item)
+            if root not in sets:
+                sets[root] = []
+                lists.append(sets[root])
+            sets[root].append(item)
+        return lists
 
 
 class Automata:
@@ -100,7 +123,7 @@ class Automata:
 
     def copy(self):
         """Returns a copy of the DFA. No data is shared with the original."""
-        return DFA(self.states, self.alphabet, self.delta, self.start, self.accepts)
+        return Automata(self.states, self.alphabet, self.delta, self.start, self.accepts)
 
 #
 # Simulating execution:
@@ -168,6 +191,21 @@ class Automata:
                 transitions[state][char] = next
         self.delta = (lambda s, c: transitions[s][c])
 
+    def merge_states(self, merges):
+        """Merges every state q1 of the hash 'merges' into merges[q1], in a single pass
+        over the transitions. The result is that of calling state_merge(q1, merges[q1])
+        for each q1, provided no merge target is itself merged.
+        Returns the hash mapping each old state to its new state (see collapse).
+        """
+        classes = {}
+        for q in self.states:
+            if q not in merges:
+                classes[q] = [q]
+        for q in self.states:
+            if q in merges:
+                classes[merges[q]].append(q)
+        return self.collapse([classes[q] for q in self.states if q not in merges])
+
     def reachable_from(self, q0, inclusive=True):
         """Returns the set of states reachable from given state q0. The optional
         parameter "inclusive" indicates that q0 should always be included.
@@ -236,6 +274,49 @@ class Automata:
                         break
         return classes
 
+    def hopcroft_classes(self):
+        """Returns a partition of self.states into Myhill-Nerode equivalence classes,
+        using Hopcroft's O(n log n) partition refinement algorithm.
+        """
+        states = list(self.states)
+        ids = dict([(q, i) for i, q in enumerate(states)])
+        #inverse[c][j] lists the states i such that delta(i, c) = j
+        inverse = {}
+        for c in self.alphabet:
+            inverse[c] = [[] for q in states]
+            for i, q in enumerate(states):
+                inverse[c][ids[self.delta(q, c)]].append(i)
+        accepts = set([ids[q] for q in self.accepts if q in ids])
+        blocks = [b for b in (accepts, set(range(len(states))) - accepts) if len(b)]
+        block = [0] * len(states)
+        for b, members in enumerate(blocks):
+            for i in members:
+                block[i] = b
+        waiting = set([(min(range(len(blocks)), key=lambda b: len(blocks[b])), c)
+                                        for c in self.alphabet if len(blocks)])
+        while len(waiting):
+            (splitter, c) = waiting.pop()
+            touched = {}
+            for j in blocks[splitter]:
+                for i in inverse[c][j]:
+                    touched.setdefault(block[i], []).append(i)
+            for (b, members) in touched.items():
+                if len(members) == len(blocks[b]):
+                    continue
+                new_b = len(blocks)
+                blocks.append(set(members))
+                blocks[b] -= blocks[new_b]
+                for i in members:
+                    block[i] = new_b
+                for char in self.alphabet:
+                    if (b, char) in waiting:
+                        waiting.add((new_b, char))
+                    elif len(blocks[new_b]) <= len(blocks[b]):
+                        waiting.add((new_b, char))
+                    else:
+                        waiting.add((b, char))
+        return [[states[i] for i in sorted(members)] for members in blocks]
+
     def collapse(self, partition):
         """Given a partition of the DFA's states into equivalence classes,
         collapses every equivalence class into a single "representative" state.
@@ -276,37 +357,116 @@ class Automata:
         self.current_state = new_current_state
         return state_map
 
-    def minimize(self):
-        """Classical DFA minimization, using the simple O(n^2) algorithm.
+    def minimize(self, algorithm='hopcroft'):
+        """Classical DFA minimization. The algorithm is either 'hopcroft' (Hopcroft's
+        O(n log n) algorithm, see hopcroft_classes) or 'simple' (the simple O(n^2)
+        algorithm, see mn_classes). Both compute the same equivalence classes.
         Side effect: can mix up the internal ordering of states.
         """
         #Step 1: Delete unreachable states
         self.delete_unreachable()
         #Step 2: Partition the states into equivalence classes        
-        classes = self.mn_classes()
+        if algorithm == 'hopcroft':
+            classes = self.hopcroft_classes()
+        elif algorithm == 'simple':
+            classes = self.mn_classes()
+        else:
+            raise ValueError, 'Unknown minimization algorithm %s' % algorithm
         #Step 3: Construct the new DFA
         self.collapse(classes)
 
     def preamble_and_kernel(self):
         """Returns the partition of the state-set into the preamble and 
         kernel as a 2-tuple. A state is in the preamble iff there 
-        are finitely many strings that reach it from the start state.
+        are finitely many strings that reach it from the start state, this is,
+        iff it is not reachable from a cyclic state reachable from the start state.
+        Runs in linear time (see cyclic_states).
 
         See "The DFAs of Finitely Different Regular Languages" for context.
         """
-        #O(n^2): can this be improved?
-        reachable = {}
-        for q in self.states:
-            reachable[q] = self.reachable_from(q, inclusive=False)
-        in_fin = self.state_hash(True)
-        for q in reachable[self.start]:
-            if q in reachable[q]:
-                for next in reachable[q]:
-                    in_fin[next] = False
-        preamble = filter(lambda x: in_fin[x], self.states)
-        kernel = filter(lambda x: not in_fin[x], self.states)
+        successors = self.successor_sets()
+        reachable = self.closure([self.start], successors)
+        cyclic = filter(lambda q: q in reachable, self.cyclic_states(successors))
+        in_kernel = self.closure(cyclic, successors)
+        preamble = filter(lambda x: x not in in_kernel, self.states)
+        kernel = filter(lambda x: x in in_kernel, self.states)
         return (preamble, kernel)
 
+    def successor_sets(self):
+        """Returns a dictionary mapping each state to the set of its successors."""
+        successors = {}
+        for q in self.states:
+            successors[q] = set([self.delta(q, c) for c in self.alphabet])
+        return successors
+
+    def closure(self, sources, successors):
+        """Returns the set of states reachable from the given states (included), 
+        following the given dictionary of successor sets."""
+        reached = set(sources)
+        to_process = list(reached)
+        while len(to_process):
+            q = to_process.pop()
+            for next in successors[q]:
+                if next not in reached:
+                    reached.add(next)
+                    to_process.append(next)
+        return reached
+
+    def strongly_connected_components(self, successors=None):
+        """Returns the strongly connected components of the DFA as lists of states,
+        in reverse topological order, using Tarjan's algorithm in O(|Q|.|alphabet|).
+        """
+        if successors is None:
+            successors = self.successor_sets()
+        index, low = {}, {}
+        stack, on_stack = [], set()
+        components = []
+        for root in self.states:
+            if root in index:
+                continue
+            index[root] = low[root] = len(index)
+            stack.append(root)
+            on_stack.add(root)
+            work = [(root, iter(successors[root]))]
+            while len(work):
+                (q, nexts) = work[-1]
+                for next in nexts:
+                    if next not in index:
+                        index[next] = low[next] = len(index)
+                        stack.append(next)
+                        on_stack.add(next)
+                        work.append((next, iter(successors[next])))
+                        break
+                    elif next in on_stack:
+                        low[q] = min(low[q], index[next])
+                else:
+                    work.pop()
+                    if len(work):
+                        parent = work[-1][0]
+                        low[parent] = min(low[parent], low[q])
+                    if low[q] == index[q]:
+                        component = []
+                        while True:
+                            state = stack.pop()
+                            on_stack.remove(state)
+                            component.append(state)
+                            if state == q:
+                                break
+                        components.append(component)
+        return components
+
+    def cyclic_states(self, successors=None):
+        """Returns the set of states that lie on a cycle, this is, that belong to a
+        strongly connected component with several states or have a self-loop."""
+        if successors is None:
+            successors = self.successor_sets()
+        cyclic = set()
+        for component in self.strongly_connected_components(successors):
+            q = component[0]
+            if len(component) > 1 or q in successors[q]:
+                cyclic.update(component)
+        return cyclic
+
     def pluck_leaves(self):
         """Only for minimized automata. Returns a topologically ordered list of
         all the states that induce a finite language. Runs in linear time.
@@ -374,33 +534,82 @@ class Automata:
         return plucked
  
     def is_finite(self):
-        """Indicates whether the DFA's language is a finite set."""
-        D2 = self.copy()
-        D2.minimize()
-        plucked = D2.pluck_leaves()
-        return (D2.start in plucked)
+        """Indicates whether the DFA's language is a finite set, this is, whether no
+        cyclic state is both reachable from the start state and co-reachable from an
+        accepting state. Runs in linear time (see cyclic_states).
+        """
+        successors = self.successor_sets()
+        predecessors = self.state_hash(list)
+        for q in self.states:
+            for next in successors[q]:
+                predecessors[next].append(q)
+        useful = self.closure([self.start], successors) & \
+                 self.closure(self.accepts, predecessors)
+        return len(useful & self.cyclic_states(successors)) == 0
 
     def states_fd_equivalent(self, q1, q2):
         """Indicates whether q1 and q2 only have finitely many distinguishing strings."""
-        d1 = DFA(states=self.states, start=q1, accepts=self.accepts, delta=self.delta, alphabet=self.alphabet)
-        d2 = DFA(states=self.states, start=q2, accepts=self.accepts, delta=self.delta, alphabet=self.alphabet)
+        d1 = Automata(states=self.states, start=q1, accepts=self.accepts, delta=self.delta, alphabet=self.alphabet)
+        d2 = Automata(states=self.states, start=q2, accepts=self.accepts, delta=self.delta, alphabet=self.alphabet)
         sd_dfa = symmetric_difference(d1, d2)
         return sd_dfa.is_finite()
 
     def f_equivalence_classes(self):
-        """Returns a partition of the states into finite-difference equivalence clases, using
-        the experimental O(n^2) algorithm."""
-        sd = symmetric_difference(self, self)
-        self_pairs = [(x, x) for x in self.states]
-        fd_equiv_pairs = sd.right_finite_states(self_pairs)
-        sets = UnionFind()
-        for state in self.states:
-            sets.make_set(state)
-        for (state1, state2) in fd_equiv_pairs:
-            set1, set2 = sets.find(state1), sets.find(state2)
-            if set1 != set2:
-                sets.union(set1, set2)
-        state_classes = sets.as_lists()
+        """Returns a partition of the states into finite-difference equivalence clases.
+        Two states are f-equivalent iff their Myhill-Nerode classes are almost-equivalent
+        in the minimal DFA, this is, iff reading any long enough string from both leads to
+        the same class. These are found on the quotient by Myhill-Nerode equivalence with
+        the O(|Q|.|alphabet|.log|Q|) algorithm of Holzer and Maletti ("An n log n algorithm
+        for hyper-minimizing a (minimized) deterministic automaton"): states with the same
+        successors are merged, the smaller block into the larger one, and the predecessors
+        of merged states are processed again. No pair of states is ever built.
+        """
+        classes = self.hopcroft_classes()
+        class_of = {}
+        for (i, state_class) in enumerate(classes):
+            for q in state_class:
+                class_of[q] = i
+        n = len(classes)
+        succ = [[class_of[self.delta(state_class[0], c)] for c in self.alphabet]
+                for state_class in classes]
+        pred = [set() for i in range(n)]
+        for (i, row) in enumerate(succ):
+            for j in row:
+                pred[j].add(i)
+        blocks = [[i] for i in range(n)]
+        alive = [True] * n
+        seen = {}
+        to_process = set(range(n))
+        while len(to_process):
+            q = to_process.pop()
+            if not alive[q]:
+                continue
+            key = tuple(succ[q])
+            p = seen.get(key)
+            if p is not None and p != q and alive[p]:
+                if len(blocks[p]) >= len(blocks[q]):
+                    (p, q) = (q, p)
+                # Merge p into q, redirecting the transitions to p
+                alive[p] = False
+                blocks[q].extend(blocks[p])
+                for r in pred[p]:
+                    if alive[r]:
+                        row = succ[r]
+                        for k in range(len(row)):
+                            if row[k] == p:
+                                row[k] = q
+                        pred[q].add(r)
+                        to_process.add(r)
+                for j in succ[p]:
+                    pred[j].discard(p)
+            seen[key] = q
+        order = dict([(q, i) for (i, q) in enumerate(self.states)])
+        state_classes = []
+        for i in range(n):
+            if alive[i]:
+                states = [q for j in blocks[i] for q in classes[j]]
+                state_classes.append(sorted(states, key=order.get))
+        state_classes.sort(key=lambda state_class: order[state_class[0]])
         return state_classes
 
     def hyper_minimize(self):
@@ -417,24 +626,23 @@ class Automata:
         state_classes = self.f_equivalence_classes()
         # Step 3: Find preamble and kernel parts
         (preamble, kernel) = self.preamble_and_kernel()
-        # Step 4: Merge (f_merge_states in the paper)
-        # (Could be done more efficiently)
+        # Step 4: Merge (f_merge_states in the paper), all at once
+        preamble = set(preamble)
+        merges = {}
         for sc in state_classes:
             pres = filter(lambda s: s in preamble, sc)
-            kers = filter(lambda s: s in kernel, sc)
+            kers = filter(lambda s: s not in preamble, sc)
             if len(kers):
                 rep = kers[0]
-                for p_state in pres:
-                    self.state_merge(p_state, rep)
             else:
-                rep = pres[0]
-                for p_state in pres[1:]:
-                        self.state_merge(p_state, rep)
+                (rep, pres) = (pres[0], pres[1:])
+            for p_state in pres:
+                merges[p_state] = rep
+        self.merge_states(merges)
 
     def levels(self):
         """Returns a dictionary mapping each state to its distance from the starting state."""
         levels = {}
-        seen = [self.start]
         levels[self.start] = 0
         level_number = 0
         level_states = [self.start]
@@ -444,8 +652,7 @@ class Automata:
             for q in level_states:
                 for c in self.alphabet:
                     next = self.delta(q, c)
-                    if next not in seen:
-                        seen.append(next)
+                    if next not in levels:
                         levels[next] = next_level_number
                         next_level_states.append(next)
             level_states = next_level_states
@@ -458,18 +665,18 @@ class Automata:
         Assumes the input is minimized.
         """
         assert(self.is_finite())
-        def long_path(q,length, longest):
+        # pluck_leaves lists every state before its successors
+        longest = {}
+        for q in reversed(self.pluck_leaves()):
+            candidates = [longest[next] + 1 for next in [self.delta(q, char) for char in self.alphabet]
+                          if next != q and longest[next] is not None]
             if q in self.accepts:
-                if length > longest:
-                    longest = length
-            for char in self.alphabet:
-                next = self.delta(q, char)
-                if next != q:
-                    candidate = long_path(next, length+1, longest)
-                    if candidate > longest:
-                        longest = candidate
-            return longest
-        return long_path(self.start, 0, None)
+                candidates.append(0)
+            if len(candidates):
+                longest[q] = max(candidates)
+            else:
+                longest[q] = None
+        return longest[self.start]
 
     def DFCA_minimize(self, l=None):
         """DFCA minimization"
@@ -479,104 +686,302 @@ class Automata:
 
         See "Minimal cover-automata for finite languages" for context on DFCAs, and
         "An O(n^2) Algorithm for Constructing Minimal Cover Automata for Finite Languages"
-        for the source of this algorithm (Campeanu, Paun, Santean, and Yu). We follow their
-        algorithm exactly, except that "l" is optionally calculated for you, and the state-
-        ordering is automatically created.
-        
-        There exists a faster, O(n*logn)-time algorithm due to Korner, from CIAA 2002.
+        (Campeanu, Paun, Santean, and Yu) for the merging scheme: every state is merged
+        into the first state that is similar to it. States are ordered by level, so that a
+        state q of level k is similar to an earlier state iff both are in the same block of
+        the Moore partition by words of length <= l-k. Following Korner ("On minimizing
+        cover automata for finite languages in O(n log n) time", CIAA 2002), all these
+        partitions are computed at once by a Hopcroft-style refinement that splits blocks
+        one length at a time, processing only the smaller parts of the blocks split at the
+        previous length, and recording when each block was split off. This takes
+        O(n*log(n)*|alphabet|) time over integer-indexed arrays. "l" is optionally
+        calculated for you.
         """
 
         assert(self.is_finite())
 
         self.minimize()
 
-        ###Step 0: Numbering the states and computing "l"
-        n = len(self.states) - 1
-        state_order = self.pluck_leaves()
+        ###Step 0: Numbering the states by level and computing "l"
         if l==None:
             l = self.longest_word_length()
-        #We're giving each state a numerical name so that the  algorithm can 
-        # run on an "ordered" DFA -- see the paper for why. These functions
-        # allow us to copiously convert between names.
-        def nn(q): # "numerical name"
-            return state_order.index(q)
-        def rn(n): # "real name"
-            return state_order[n]
-
-        ###Step 1: Computing the gap function
-        # 1.1 -- Step numbering is from the paper
-        level = self.levels() #holds real names
-        gap = {}  #holds numerical names
-        # 1.2 
+        if l==None: # empty language: already a single state
+            return l
+        level = self.levels()
+        topological = dict([(q, i) for (i, q) in enumerate(self.pluck_leaves())])
+        order = sorted(self.states, key=lambda q: (level[q], topological[q]))
+        n = len(order)
+        ids = dict([(q, i) for (i, q) in enumerate(order)])
+        levels = array('i', [level[q] for q in order])
+        symbols = list(self.alphabet)
+        successors = [array('i', [ids[self.delta(q, c)] for q in order]) for c in symbols]
+        inverse = [[[] for i in range(n)] for c in symbols]
+        for (c, succ) in enumerate(successors):
+            for i in range(n):
+                inverse[c][succ[i]].append(i)
+
+        ###Step 1: Refining the Moore partitions P_0, P_1, ..., P_l
+        # P_k groups the states that no word of length <= k distinguishes. Blocks are
+        # numbered in order of creation: when a block splits, its largest part keeps
+        # its number and the other parts become new blocks, born at length k, whose
+        # parent is the split block. "Block X at length k" is thus X together with its
+        # descendants born after k. Two states of P_(k-1) only part in P_k if, for some
+        # symbol, their successors lie in different parts of a block split at length
+        # k-1; as the largest part can be left out, each state moves O(log n) times.
+        block = array('i', [0] * n)     # current block of each state
+        members = [range(n)]            # current states of each block
+        position = array('i', range(n)) # index of each state in members[block]
+        birth = [-1]
+        parent = [-1]
+        children = [[]]
+        def split(X, groups, length):
+            # groups: lists of states of X, not covering X if untouched states remain
+            untouched = len(members[X]) - sum([len(group) for group in groups])
+            if untouched == 0 and len(groups) == 1:
+                return []
+            largest = max(groups, key=len)
+            if untouched > len(largest):
+                # The untouched states stay: remove the others from X
+                moved = groups
+                states = members[X]
+                for group in groups:
+                    for i in group:
+                        last = states.pop()
+                        if last != i:
+                            states[position[i]] = last
+                            position[last] = position[i]
+            else:
+                # The largest part stays: the untouched states move with the others
+                moved = [group for group in groups if group is not largest]
+                if untouched:
+                    marked = set([i for group in groups for i in group])
+                    moved.append([i for i in members[X] if i not in marked])
+                members[X] = list(largest)
+                for (k, i) in enumerate(largest):
+                    position[i] = k
+            new_blocks = []
+            for group in moved:
+                Y = len(members)
+                members.append(group)
+                for (k, i) in enumerate(group):
+                    block[i] = Y
+                    position[i] = k
+                birth.append(length)
+                parent.append(X)
+                children.append([])
+                children[X].append(Y)
+                new_blocks.append(Y)
+            return new_blocks
+        # P_0 splits the accepting states from the others
+        accepting = [i for i in range(n) if order[i] in self.accepts]
+        splitters = accepting and split(0, [accepting], 0) or []
+        length = 1
+        while len(splitters) and length <= l:
+            marks = {}
+            for Y in splitters:
+                for c in range(len(symbols)):
+                    for j in members[Y]:
+                        for i in inverse[c][j]:
+                            marks.setdefault(i, []).append((c, Y))
+            touched = {}
+            for (i, signature) in marks.iteritems():
+                touched.setdefault(block[i], {}).setdefault(tuple(signature), []).append(i)
+            splitters = []
+            for (X, groups) in touched.iteritems():
+                splitters.extend(split(X, groups.values(), length))
+            length += 1
+
+        ###Step 2: Finding, for each state, the first state similar to it
+        # States are numbered in level order, so the first state similar to a state of
+        # level k is the smallest state of its block at length l-k. smallest[X] is the
+        # smallest state of X, lowest[X] that of X with all its descendants, and
+        # after_birth[X][t] that of the children of X from the t-th on (children are
+        # created by increasing birth).
+        smallest = [min(states) for states in members]
+        lowest = list(smallest)
+        for X in range(len(members) - 1, 0, -1):
+            lowest[parent[X]] = min(lowest[parent[X]], lowest[X])
+        births = [[birth[Y] for Y in children[X]] for X in range(len(members))]
+        after_birth = []
+        for X in range(len(members)):
+            suffix = [lowest[Y] for Y in children[X]] + [n]
+            for t in range(len(suffix) - 2, -1, -1):
+                suffix[t] = min(suffix[t], suffix[t + 1])
+            after_birth.append(suffix)
+        # States of level > l are similar to every state
+        first = array('i', [0] * n)
         for i in range(n):
-            gap[(i, n)] = l
-        if level[rn(n)] <= l:
-            for q in self.accepts:
-                gap[(nn(q), n)] = 0
-        # 1.3
-        for i in range(n-1):
-            for j in range(i+1, n):
-                if (rn(i) in self.accepts)^(rn(j) in self.accepts):
-                    gap[(i,j)] = 0
-                else:
-                    gap[(i,j)] = l
-        # 1.4
-        def level_range(i, j):
-            return l - max(level[rn(i)], level[rn(j)])
-        for i in range(n-2, -1, -1):
-            for j in range(n, i, -1):
-                for char in self.alphabet:
-                    i2 = nn(self.delta(rn(i), char))
-                    j2 = nn(self.delta(rn(j), char))
-                    if i2 != j2:
-                        if i2 < j2:
-                            g = gap[(i2, j2)]
-                        else:
-                            g = gap[(j2, i2)]
-                        if g+1 <= level_range(i, j):
-                            gap[(i,j)] = min(gap[(i,j)], g+1)
-
-        ###Step 2: Merging states
-        # 2.1
-        P = {}
-        for i in range(n+1):
-            P[i] = False
-        # 2.2
+            k = l - levels[i]
+            if k < 0:
+                continue
+            X = block[i]
+            while birth[X] > k:     # O(log n) steps: a part is at most half its parent
+                X = parent[X]
+            t = bisect.bisect_right(births[X], k)
+            first[i] = min(smallest[X], after_birth[X][t])
+
+        ###Step 3: Merging states
+        # The first state similar to q is merged into some r; r is then similar to q
+        rep = array('i', range(n))
+        merges = {}
         for i in range(n):
-            if P[i] == False:
-                for j in range(i+1, n+1):
-                    if (P[j] == False) and (gap[(i,j)] == l):
-                        self.state_merge(rn(j), rn(i))
-                        P[j] = True
+            if first[i] != i:
+                rep[i] = rep[first[i]]
+                merges[order[i]] = order[rep[i]]
+        self.merge_states(merges)
         return l
 
+#
+# Table-backed DFAs
+#
+
+class TableAutomata(Automata):
+    """This class represents a DFA whose states are the integers 0..n-1 and whose
+    transitions are stored in a contiguous int32 array, row by row: the successor of
+    q by the i-th symbol of self.symbols is table[q * len(self.symbols) + i].
+    delta reads the table, and merging or collapsing states updates the table in
+    place instead of wrapping delta, so lookups never get slower. collapse renumbers
+    the remaining states to 0..m-1 (see compact).
+    """
+    def __init__(self, size, symbols, transitions, start, accepts, labels=None):
+        """The inputs to the class are as follows:
+         - size: The number n of states, which are 0..n-1.
+         - symbols: A list containing the symbols in the DFA's alphabet.
+         - transitions: An iterable of n * len(symbols) states, row by row.
+         - start, accepts: As for Automata.
+         - labels: An optional list giving a name to each state (see from_automata).
+        """
+        self.symbols = list(symbols)
+        self.symbol_ids = dict([(c, i) for (i, c) in enumerate(self.symbols)])
+        self.width = len(self.symbols)
+        self.table = array('i', transitions)
+        assert len(self.table) == size * self.width
+        self.labels = labels
+        Automata.__init__(self, range(size), self.symbols, self.table_delta, start, accepts)
+
+    def table_delta(self, q, c):
+        return self.table[q * self.width + self.symbol_ids[c]]
+
+    def copy(self):
+        """Returns a copy of the DFA. No data is shared with the original."""
+        D = TableAutomata(0, self.symbols, [], self.start, self.accepts, copy(self.labels))
+        D.table = array('i', self.table)
+        D.states = set(self.states)
+        D.current_state = self.current_state
+        return D
+
+    def to_automata(self):
+        """Returns an equivalent Automata whose delta is a closure over a copy of
+        the table."""
+        table, width, symbol_ids = array('i', self.table), self.width, dict(self.symbol_ids)
+        delta = lambda q, c: table[q * width + symbol_ids[c]]
+        return Automata(self.states, self.symbols, delta, self.start, self.accepts)
+
+    def state_merge(self, q1, q2):
+        """Merges q1 into q2. All transitions to q1 are moved to q2.
+        If q1 was the start or current state, those are also moved to q2.
+        """
+        self.states.remove(q1)
+        if q1 in self.accepts:
+            self.accepts.remove(q1)
+        if self.current_state == q1:
+            self.current_state = q2
+        if self.start == q1:
+            self.start = q2
+        table = self.table
+        for i in xrange(len(table)):
+            if table[i] == q1:
+                table[i] = q2
+
+    def collapse(self, partition):
+        """Given a partition of the DFA's states into equivalence classes,
+        collapses every equivalence class into a single state, and renumbers states.
+        Returns the hash mapping each old state to its new state.
+        """
+        state_map = {}
+        for state_class in partition:
+            for state in state_class:
+                state_map[state] = state_class[0]
+        representatives = set(state_map.values())
+        for q in representatives:
+            for i in xrange(q * self.width, (q + 1) * self.width):
+                self.table[i] = state_map[self.table[i]]
+        self.accepts = [q for q in self.accepts if q in representatives]
+        self.start = state_map[self.start]
+        self.current_state = state_map.get(self.current_state, self.start)
+        self.states = representatives
+        renumbering = self.compact()
+        for state in state_map:
+            state_map[state] = renumbering[state_map[state]]
+        return state_map
+
+    def compact(self):
+        """Renumbers the states to 0..n-1, dropping the rows of deleted states.
+        Returns the hash mapping each remaining state to its new number.
+        """
+        order = sorted(self.states)
+        ids = dict([(q, i) for (i, q) in enumerate(order)])
+        width = self.width
+        self.table = array('i', [ids[self.table[q * width + i]] for q in order for i in range(width)])
+        if self.labels is not None:
+            self.labels = [self.labels[q] for q in order]
+        self.states = set(range(len(order)))
+        self.accepts = set([ids[q] for q in self.accepts])
+        self.start = ids[self.start]
+        self.current_state = ids.get(self.current_state, self.start)
+        return ids
+
+def from_automata(D):
+    """Constructs a TableAutomata equivalent to the given DFA. State i of the new DFA
+    is the i-th state of D, and its name is kept in labels[i]."""
+    labels = list(D.states)
+    try:
+        labels.sort()
+    except TypeError:
+        pass
+    ids = dict([(q, i) for (i, q) in enumerate(labels)])
+    symbols = list(D.alphabet)
+    transitions = [ids[D.delta(q, c)] for q in labels for c in symbols]
+    T = TableAutomata(len(labels), symbols, transitions, ids[D.start],
+                      [ids[q] for q in D.accepts], labels)
+    T.current_state = ids[D.current_state]
+    return T
+
 #
 # Boolean set operations on languages -- end of the DFA class
 #
 
-def cross_product(D1, D2, accept_method):
+def cross_product(D1, D2, accept_method, seeds=None):
     """A generalized cross-product constructor over two DFAs. 
     The third argument is a binary boolean function f; a state (q1, q2) in the final
     DFA accepts if f(A[q1],A[q2]), where A indicates the acceptance-value of the state.
+    Only the pairs reachable from the start pair (q1, q2) and from the optional seed
+    pairs are built, on the fly. The result is a TableAutomata whose labels are the pairs.
     """
     assert(D1.alphabet == D2.alphabet)
-    states = []
-    for s1 in D1.states:
-        for s2 in D2.states:
-            states.append((s1,s2))
+    symbols = list(D1.alphabet)
     start = (D1.start, D2.start)
-    def delta(state_pair, char):
-        next_D1 = D1.delta(state_pair[0], char)
-        next_D2 = D2.delta(state_pair[1], char)
-        return (next_D1, next_D2)
-    alphabet = copy(D1.alphabet)
-    accepts = []
-    for (s1, s2) in states:
-        a1 = s1 in D1.accepts
-        a2 = s2 in D2.accepts
-        if accept_method(a1, a2):
-            accepts.append((s1, s2))
-    return DFA(states=states, start=start, delta=delta, accepts=accepts, alphabet=alphabet)
+    pairs = [start]
+    ids = {start: 0}
+    for pair in (seeds or []):
+        if pair not in ids:
+            ids[pair] = len(pairs)
+            pairs.append(pair)
+    transitions = []
+    i = 0
+    while i < len(pairs):
+        (s1, s2) = pairs[i]
+        for char in symbols:
+            next = (D1.delta(s1, char), D2.delta(s2, char))
+            if next not in ids:
+                ids[next] = len(pairs)
+                pairs.append(next)
+            transitions.append(ids[next])
+        i += 1
+    accepts1, accepts2 = set(D1.accepts), set(D2.accepts)
+    accepts = [i for (i, (s1, s2)) in enumerate(pairs) 
+               if accept_method(s1 in accepts1, s2 in accepts2)]
+    return TableAutomata(len(pairs), symbols, transitions, 0, accepts, pairs)
 
 def intersection(D1, D2):
     """Constructs an unminimized DFA recognizing the intersection of the languages of two given DFAs."""
@@ -593,13 +998,39 @@ def symmetric_difference(D1, D2):
     f = bool.__xor__
     return cross_product(D1, D2, f)
 
+def equivalent(D1, D2):
+    """Indicates whether two DFAs recognize the same language, using the near-linear
+    algorithm of Hopcroft and Karp: states are merged (in a UnionFind) along the
+    transitions from the pair of start states, and the languages differ iff two
+    merged states disagree on acceptance.
+    """
+    assert(D1.alphabet == D2.alphabet)
+    accepts1, accepts2 = set(D1.accepts), set(D2.accepts)
+    sets = UnionFind()
+    for q in D1.states:
+        sets.make_set((1, q))
+    for q in D2.states:
+        sets.make_set((2, q))
+    sets.union((1, D1.start), (2, D2.start))
+    to_process = [(D1.start, D2.start)]
+    while len(to_process):
+        (q1, q2) = to_process.pop()
+        if (q1 in accepts1) != (q2 in accepts2):
+            return False
+        for c in D1.alphabet:
+            next1, next2 = D1.delta(q1, c), D2.delta(q2, c)
+            if sets.find((1, next1)) != sets.find((2, next2)):
+                sets.union((1, next1), (2, next2))
+                to_process.append((next1, next2))
+    return True
+
 def inverse(D):
     """Constructs an unminimized DFA recognizing the inverse of the language of a given DFA."""
     new_accepts = []
     for state in D.states:
         if state not in D.accepts:
             new_accepts.append(state)
-    return DFA(states=D.states, start=D.start, delta=D.delta, accepts=new_accepts, alphabet=D.alphabet)
+    return Automata(states=D.states, start=D.start, delta=D.delta, accepts=new_accepts, alphabet=D.alphabet)
 
 # 
 # Constructing new DFAs
@@ -623,7 +1054,7 @@ def from_word_list(language, alphabet):
             return next
         else:
             return sink
-    return DFA(states=states, alphabet=alphabet, delta=delta, start=start, accepts=accepts)
+    return Automata(states=states, alphabet=alphabet, delta=delta, start=start, accepts=accepts)
 
 def modular_zero(n, base=2):
     """Returns a DFA that accepts all binary numbers equal to 0 mod n. Use the optional
@@ -635,7 +1066,7 @@ def modular_zero(n, base=2):
     delta = lambda q, c: ((q*base+int(c)) % n)
     start = 0
     accepts = [0]
-    return DFA(states=states, alphabet=alphabet, delta=delta, start=start, accepts=accepts)
+    return Automata(states=states, alphabet=alphabet, delta=delta, start=start, accepts=accepts)
 
 def random(states_size, alphabet_size, acceptance=0.5):
     """Constructs a random DFA with "states_size" states and "alphabet_size" inputs. Each 
@@ -654,7 +1085,7 @@ def random(states_size, alphabet_size, acceptance=0.5):
         for c in alphabet:
             tt[q][c] = random.choice(states)
     delta = lambda q, c: tt[q][c]
-    return DFA(states, alphabet, delta, start, accepts)
+    return Automata(states, alphabet, delta, start, accepts)
 
 # 
 # Finite-factoring
@@ -32,13 +32,14 @@ def KPM_DFA(w):
     finalStates = [w]
     states = [w[:i] for i in range(len(w)+1)]
     transitions = []
+    index = sequence.pattern_index(w)
 
     for from_s in states:
         for c in alphabet:
             if from_s == w:
                 transitions.append( (from_s, from_s, c) )
             else:
-                to_s = sequence.sufpre(from_s + c,w)
+                to_s = w[:index.step(len(from_s), c)]
                 transitions.append( (from_s, to_s, c) )
     
     return (states, alphabet, transitions, initialState, finalStates)
@@ -1,10 +1,19 @@
 #!/usr/bin/python
 
+import collections
+import itertools
 import sequence
 import words
 
 from automata import Automata
-from multiword import Multiword
+from multiword import Multiword, CompactMultiword
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+SYMBOL_CACHE_SIZE = 65536   # Sets of symbols (or bitmasks) mapped to a column
 
 
 class Certain(object):
@@ -23,6 +32,20 @@ class Certain(object):
             self.word = word
         else:
             raise TypeError, 'Argument type %s unsupported' % type(word)
+        self.index = sequence.pattern_index(word)
+        self.steps = {}         # (state, symbol) -> successor before reduction
+        self.transitions = {}   # (state, set of symbols) -> successor
+        # Compiled matcher: table[q][s] is the id of the successor of the
+        # state of id q by the set of symbols of id s, or -1 if not computed
+        # yet. Symbol 0 is a padding symbol that loops on every state. 
+        self.compiled_states = [self.index.start]
+        self.state_ids = {self.index.start: 0}
+        self.symbols = [None]
+        self.symbol_ids = {}    # set of symbols -> id of its column
+        self.column_ids = {}    # normalized set of symbols -> id
+        self.mask_ids = {}      # alphabet -> bitmask -> id of its column
+        self.table = [[0]]
+        self.array = None       # numpy copy of the table, once complete
         
         
     def get_word(self):
@@ -35,49 +58,353 @@ class Certain(object):
     def contains(self, multiword):
         """
         Return true iff certain(w) contains the given multiword.
+        The multiword is run through the compiled table, whose missing 
+        transitions are computed (once) on demand. 
         """
-        if isinstance(multiword, Multiword):
-            return self.word in M
+        if isinstance(multiword, (Multiword, CompactMultiword)):
+            q = 0
+            for s in self.encode(multiword):
+                q = self.next_id(q, s)
+            return self.compiled_states[q] == 0
         else:
             raise TypeError, 'Argument type %s unsupported' % type(multiword)
 
+
+    def contains_many(self, multiwords):
+        """
+        Return, for each multiword of given list, whether certain(w) 
+        contains it. The multiwords are encoded as a padded matrix of symbol
+        ids, the table is completed for these symbols, and the states of all
+        the multiwords are advanced together, one column at a time, by 
+        lookups in the table. Return a boolean numpy array, or a list of 
+        booleans if numpy is not available. 
+        """
+        multiwords = list(multiwords)
+        if numpy is None:
+            rows = [self.encode(multiword) for multiword in multiwords]
+            table = self.compile()
+            accept = self.state_ids.get(0, -1)
+            result = []
+            for row in rows:
+                q = 0
+                for s in row:
+                    q = table[q][s]
+                result.append(q == accept)
+            return result
+
+        matrix = self.encode_many(multiwords)
+        table = self.compile()
+        accept = self.state_ids.get(0, -1)
+        q = numpy.zeros(len(multiwords), dtype=numpy.int32)
+        for j in range(matrix.shape[1]):
+            q = table[q, matrix[:, j]]
+        return q == accept
+
+
+    def encode_many(self, multiwords):
+        """
+        Return the padded matrix (numpy array) of the symbol ids of the 
+        positions of given multiwords. The bitmasks of the compact 
+        multiwords over a common alphabet of less than 64 symbols are 
+        encoded all at once: symbols that do not occur in w are collapsed 
+        into a spare bit, so that few distinct masks remain to be mapped to
+        columns (through a lookup table when they are small, and 
+        numpy.unique otherwise). Other multiwords are encoded one by one. 
+        """
+        alphabet = None
+        for multiword in multiwords:
+            if isinstance(multiword, CompactMultiword):
+                alphabet = multiword.alphabet
+                break
+        if alphabet is not None and len(alphabet) >= 64:
+            alphabet = None
+        compact, rows = [], {}
+        for i, multiword in enumerate(multiwords):
+            if isinstance(multiword, CompactMultiword) and \
+                    multiword.alphabet is alphabet:
+                compact.append(i)
+            else:
+                rows[i] = self.encode(multiword)
+        lengths = numpy.array([len(multiwords[i].masks) for i in compact], 
+                                                    dtype=numpy.int64)
+        width = max([len(row) for row in rows.values()] + 
+                                    [int(lengths.max()) if len(compact) else 0])
+        matrix = numpy.zeros((len(multiwords), width), dtype=numpy.int32)
+        for i, row in rows.iteritems():
+            matrix[i, :len(row)] = row
+        if not len(compact):
+            return matrix
+
+        # Bitmasks of the symbols of w, and a spare bit for the other ones
+        relevant = 0
+        for a in self.index.alphabet:
+            if a in alphabet.index:
+                relevant |= 1 << alphabet.index[a]
+        spare = 1
+        while spare & relevant:
+            spare <<= 1
+        total = int(lengths.sum())
+        if not total:
+            return matrix
+        buffers = [multiwords[i].masks for i in compact]
+        typecodes = set([getattr(masks, 'typecode', None) for masks in buffers])
+        if len(typecodes) == 1 and None not in typecodes:
+            buffer = ''.join([masks.tostring() for masks in buffers])
+            masks = numpy.frombuffer(buffer, dtype=numpy.dtype(typecodes.pop()))
+            masks = masks.astype(numpy.uint64)
+        else:
+            masks = numpy.fromiter(itertools.chain.from_iterable(buffers), 
+                                            dtype=numpy.uint64, count=total)
+        relevant, spare = numpy.uint64(relevant), numpy.uint64(spare)
+        keys = (masks & relevant) | numpy.where(masks & ~relevant, spare, 
+                                                            numpy.uint64(0))
+        if int(keys.max()) < 1 << 16:   # Small keys index a lookup table
+            keys = keys.astype(numpy.intp)
+            uniq = numpy.flatnonzero(numpy.bincount(keys))
+            slots, inverse = uniq, keys
+        else:
+            uniq, inverse = numpy.unique(keys, return_inverse=True)
+            slots = numpy.arange(len(uniq))
+        lookup = numpy.zeros(slots[-1] + 1, dtype=numpy.int32)
+        for slot, key in zip(slots, uniq):
+            key = int(key)
+            symbols = set(alphabet.decode(key & int(relevant)))
+            if key & int(spare):
+                symbols.add(None)
+            lookup[slot] = self.column(frozenset(symbols))
+        starts = numpy.cumsum(lengths) - lengths
+        matrix[numpy.repeat(numpy.array(compact), lengths), 
+               numpy.arange(total) - numpy.repeat(starts, lengths)] = \
+                    lookup[inverse]
+        return matrix
+
+
+    def compile(self):
+        """
+        Complete the table for every interned set of symbols, and return it
+        (as a numpy array if numpy is available). 
+        """
+        if self.array is not None:
+            return self.array
+        q = 0
+        while q < len(self.table):
+            for s in range(1, len(self.symbols)):
+                self.next_id(q, s)
+            q += 1
+        if numpy is None:
+            return self.table
+        self.array = numpy.array(self.table, dtype=numpy.int32)
+        return self.array
+
+
+    def encode(self, multiword):
+        """ Return the list of symbol ids of the positions of multiword.
+        Columns of the table are keyed by normalized sets of symbols (see
+        sequence.PatternIndex.normalize), so that positions that behave the
+        same wrt. w share a column. The bitmasks of compact multiwords are
+        mapped to columns without decoding them. """
+        if isinstance(multiword, CompactMultiword):
+            alphabet = multiword.alphabet
+            ids = self.mask_ids.setdefault(alphabet, {})
+            elements = multiword.masks
+            normalize = lambda mask: self.index.normalize(alphabet.decode(mask))
+        else:
+            ids = self.symbol_ids
+            elements = [frozenset(el) for el in multiword]
+            normalize = self.index.normalize
+        row = []
+        for el in elements:
+            try:
+                row.append(ids[el])
+            except KeyError:
+                if len(ids) >= SYMBOL_CACHE_SIZE:
+                    ids.clear()
+                ids[el] = self.column(normalize(el))
+                row.append(ids[el])
+        return row
+
+
+    def column(self, symbols):
+        """ Return the id of the column of a normalized set of symbols,
+        adding the column to the table if needed """
+        try:
+            return self.column_ids[symbols]
+        except KeyError:
+            self.column_ids[symbols] = len(self.symbols)
+            self.symbols.append(symbols)
+            for table_row in self.table:
+                table_row.append(-1)
+            self.array = None
+            return self.column_ids[symbols]
+
+
+    def next_id(self, q, s):
+        """ Return table[q][s], computing it if needed """
+        dest = self.table[q][s]
+        if dest < 0:
+            state = self.transition(self.compiled_states[q], self.symbols[s])
+            if state not in self.state_ids:
+                self.state_ids[state] = len(self.compiled_states)
+                self.compiled_states.append(state)
+                self.table.append([self.state_ids[state]] + 
+                                            [-1] * (len(self.symbols) - 1))
+            dest = self.state_ids[state]
+            self.table[q][s] = dest
+            self.array = None
+        return dest
+
+    
+    def transition(self, state, symbols):
+        """
+        Return the set of prefixes (encoded as in sequence.PatternIndex)
+        reachable from given state by reading any symbol of symbols. 
+        Set-labelled transitions are derived lazily from the per-symbol 
+        transitions, as the lower bound of the union of their successors,
+        and both are memoized. Symbols that do not occur in w are collapsed
+        so that arbitrary sets of symbols share transitions. 
+        """
+        symbols = self.index.normalize(symbols)
+        try:
+            return self.transitions[(state, symbols)]
+        except KeyError:
+            union = 0
+            for a in symbols:
+                union |= self.step(state, a)
+            dest = self.index.lower_bound(union)
+            self.transitions[(state, symbols)] = dest
+            return dest
+
+
+    def step(self, state, symbol):
+        """
+        Return the (non reduced) set of prefixes reachable from given state
+        by reading the given symbol. 
+        """
+        try:
+            return self.steps[(state, symbol)]
+        except KeyError:
+            dest = 0
+            for row in self.index.rows(state):
+                dest |= row.get(symbol, 1)
+            self.steps[(state, symbol)] = dest
+            return dest
+
     
-    def automaton(self):
+    def automaton(self, alphabet=None):
         """
         return a deterministic finite automaton recognizing the current language.
+        The alphabet is an iterable of sets of symbols, it defaults to the 
+        pairs of symbols of w. States are integers: the reachable sets of 
+        prefixes are interned during a breadth-first exploration that fills
+        a dense transition table, which then drives the automaton. 
         """   
-        def next_state(state, w, symbol):
-            """ 
-            Return the (frozen) set of prefixes reachable from given state
-            by reading (symbols of) symbol for the given word w. 
-            """
-            n_state = set()
-            for e in state:
-                for a in symbol:
-                    n_state.add(sequence.sufpre(e+a, w))
-            return frozenset(sequence.lower_bound(n_state, w))
-            
-        alphabet = words.get_alphabet(self.word)
-        powerset_alphabet = frozenset(
-            [frozenset([a, b]) for a in alphabet for b in alphabet]
-        )   # This corresponds to the relevant subset of the powerset alphabet
-        states = [frozenset([''])]
-        states_left = [frozenset([''])]    
-        while len(states_left) > 0:
-            state = states_left.pop()
-            for symbol in powerset_alphabet:
-                dest = next_state(state, self.word, symbol)
-                if dest not in states:
-                    states.append(dest)
-                    states_left.append(dest)
-        start = frozenset([''])   # empty word
-        accepts = [frozenset([])]   # empty set      
-        delta = lambda q, a: next_state(q, self.word, a)
+        powerset_alphabet = self.powerset_alphabet(alphabet)
+        prefix_sets, table = transition_table(self.index, powerset_alphabet,
+                                                            self.transition)
+        symbol_ids = dict([(a, i) for i, a in enumerate(powerset_alphabet)])
+        states = range(len(prefix_sets))
+        start = 0   # {''}, the empty word
+        accepts = [q for q in states if prefix_sets[q] == 0]   # empty set
+        delta = lambda q, a: table[q][symbol_ids[a]]
         return Automata(states, powerset_alphabet, delta, start, accepts)
         
 
+    def minimal_automaton(self, alphabet=None):
+        """
+        Return the minimal deterministic finite automaton recognizing the
+        current language (see automaton for the alphabet). Equivalent sets
+        of prefixes are merged during the exploration, so that no more 
+        states than the minimal ones are ever built. 
+
+        Let N be the automaton whose states are the prefixes of w (except 
+        w) and that follows index.step. A multiword is not in certain(w) 
+        iff N can read it from {''}. First, the reverse of N is 
+        determinized, its states R being the sets of prefixes from which N 
+        can read some multiword. Then, two sets of prefixes S and T are 
+        equivalent iff they intersect the same reverse states R (Brzozowski),
+        and only one representative per class is explored. 
+        """
+        powerset_alphabet = self.powerset_alphabet(alphabet)
+        symbol_ids = dict([(a, i) for i, a in enumerate(powerset_alphabet)])
+        reverse = self.reverse_states(powerset_alphabet)
+        def signature(state):
+            sig = 0
+            for i, r in enumerate(reverse):
+                if state & r:
+                    sig |= 1 << i
+            return sig
+
+        representatives = [self.index.start]
+        ids = {signature(self.index.start): 0}
+        table = []
+        while len(table) < len(representatives):
+            state = representatives[len(table)]
+            row = []
+            for symbol in powerset_alphabet:
+                dest = self.transition(state, symbol)
+                sig = signature(dest)
+                if sig not in ids:
+                    ids[sig] = len(representatives)
+                    representatives.append(dest)
+                row.append(ids[sig])
+            table.append(row)
+        states = range(len(representatives))
+        accepts = [ids[0]] if 0 in ids else []   # empty set
+        delta = lambda q, a: table[q][symbol_ids[a]]
+        return Automata(states, powerset_alphabet, delta, 0, accepts)
+
+
+    def reverse_states(self, alphabet):
+        """
+        Return the list of the sets of prefixes of w (as bitmasks, w being
+        excluded) from which some multiword over alphabet can be read 
+        without completing w. This is the subset construction of the 
+        reverse automaton, starting from the set of every prefix. 
+        """
+        index, n = self.index, len(self.word)
+        # inverse[a][t] is the set of prefixes k such that step(k, a) = t
+        inverse = {}
+        for a in set([a for symbol in alphabet 
+                            for a in self.index.normalize(symbol)]):
+            inverse[a] = [0] * (n + 1)
+            for k in range(n):
+                inverse[a][index.step(k, a)] |= 1 << k
+        alphabet = [self.index.normalize(symbol) for symbol in alphabet]
+        states = [index.full - 1]
+        seen = set(states)
+        for state in states:
+            for symbol in alphabet:
+                dest = 0
+                for t in index.lengths(state):
+                    for a in symbol:
+                        dest |= inverse[a][t]
+                if dest not in seen:
+                    seen.add(dest)
+                    states.append(dest)
+        return states
+
+
+    def powerset_alphabet(self, alphabet=None):
+        """
+        Return the given iterable of sets of symbols as a list of frozen 
+        sets. Defaults to the pairs of symbols of w, which corresponds to 
+        the relevant subset of the powerset alphabet. 
+        """
+        if alphabet is None:
+            alphabet = words.get_alphabet(self.word)
+            alphabet = [[a, b] for a in alphabet for b in alphabet]
+        return list(frozenset(map(frozenset, alphabet)))
+
+
+    def lazy_automaton(self, maxsize=65536):
+        """
+        Return a LazyAutomaton for certain(w), for membership queries only.
+        """
+        return LazyAutomaton(self.word, maxsize)
+
+
     def __contains__(self, other):
-        return contains(self, other)
+        return self.contains(other)
         
         
     def __str__(self):
@@ -87,3 +414,188 @@ class Certain(object):
         return str(self)
         
 
+
+def transition_table(index, symbols, successor=None):
+    """
+    Explore the states (encoded as in sequence.PatternIndex) reachable from
+    index.start by reading the given list of symbols (sets of symbols). 
+    Return a pair (states, table) where states is the list of reached 
+    states, states[0] being index.start, and table[i][j] is the position in
+    states of the successor of states[i] by symbols[j]. The successor 
+    function defaults to index.successor. 
+    """
+    successor = successor or index.successor
+    states = [index.start]
+    ids = {index.start: 0}
+    table = []
+    while len(table) < len(states):
+        state = states[len(table)]
+        row = []
+        for symbol in symbols:
+            dest = successor(state, symbol)
+            if dest not in ids:
+                ids[dest] = len(states)
+                states.append(dest)
+            row.append(ids[dest])
+        table.append(row)
+    return states, table
+
+
+class LazyAutomaton(object):
+    """
+    Demand-driven automaton of certain(w), for membership queries only. 
+    States (sets of prefixes encoded as in sequence.PatternIndex) and 
+    transitions are only created when a multiword reaches them, and the 
+    transitions are memoized in a bounded cache. The cache keeps two 
+    generations of at most maxsize / 2 transitions: when the recent one is
+    full, the older one is evicted, and transitions found in the older one
+    are promoted back. This approximates a LRU policy without bookkeeping
+    on hits, so that memory stays flat while hot transitions remain dict 
+    lookups. 
+    """
+
+    def __init__(self, word, maxsize=65536):
+        self.word = word
+        self.index = sequence.pattern_index(word)
+        self.maxsize = maxsize
+        self.recent = {}
+        self.older = {}
+        self.hits = 0
+        self.misses = 0
+
+    def delta(self, state, symbols):
+        """ Return the successor of state by reading a set of symbols. 
+        Sets of symbols are normalized (see sequence.PatternIndex.normalize)
+        so that the sets that behave the same wrt. w share transitions. """
+        key = (state, self.index.normalize(symbols))
+        try:
+            dest = self.recent[key]
+            self.hits += 1
+            return dest
+        except KeyError:
+            pass
+        try:
+            dest = self.older[key]
+            self.hits += 1
+        except KeyError:
+            dest = self.index.successor(state, key[1])
+            self.misses += 1
+        if len(self.recent) >= max(1, self.maxsize / 2):
+            self.older, self.recent = self.recent, {}
+        self.recent[key] = dest
+        return dest
+
+    def contains(self, multiword):
+        """ Return true iff certain(w) contains the given multiword """
+        state = self.index.start
+        for el in multiword:
+            if state == 0:      # The empty set of prefixes is a sink
+                break
+            state = self.delta(state, el)
+        return state == 0
+
+    def __contains__(self, other):
+        return self.contains(other)
+
+    def __len__(self):
+        """ Return the number of cached transitions """
+        return len(self.recent) + len(self.older)
+
+
+CERTAIN_CACHE_SIZE = 256
+_certains = {}
+
+def certain_many(w, multiwords):
+    """
+    Return, for each multiword of given list, whether w is certain in it.
+    See Certain.contains_many. The Certain of w, whose table is compiled 
+    along the way, is kept for later calls. 
+    """
+    try:
+        language = _certains[w]
+    except KeyError:
+        if len(_certains) >= CERTAIN_CACHE_SIZE:
+            _certains.clear()
+        language = _certains[w] = Certain(w)
+    return language.contains_many(multiwords)
+
+
+class AutomataCache(object):
+    """
+    LRU cache of the automata of certain(w), keyed by the canonical 
+    representative of w under permutations of symbols (see 
+    words.canonical). Indeed, the automata of certain(w) and certain(w') 
+    are the same up to a renaming of symbols when w' is obtained from w by
+    such a permutation, so automata are built for the canonical word and 
+    their alphabet is relabelled on each request. Note that reversal can
+    not be used: certain(w) and certain(reverse(w)) may have minimal 
+    automata of different sizes (e.g. aaabab and babaaa). 
+    Sizes are plain integers, and are kept in an unbounded dict: in 
+    exhaustive runs, the words of an orbit are far apart in enumeration
+    order, so they would not survive in a bounded cache. 
+    """
+
+    def __init__(self, maxsize=4096):
+        self.maxsize = maxsize
+        self.entries = collections.OrderedDict()
+        self.sizes = {}
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, build):
+        """ Return the entry for key, building it with build() if needed """
+        try:
+            value = self.entries.pop(key)
+            self.hits += 1
+        except KeyError:
+            value = build()
+            self.misses += 1
+            if len(self.entries) >= self.maxsize:
+                self.entries.popitem(last=False)
+        self.entries[key] = value
+        return value
+
+    def automaton(self, word, minimal=False):
+        """ 
+        Return a new automaton for certain(word), as returned by
+        Certain.automaton() (or Certain.minimal_automaton() if minimal).
+        """
+        canonical = words.canonical(word)
+        if minimal:
+            build = lambda: Certain(canonical).minimal_automaton()
+        else:
+            build = lambda: Certain(canonical).automaton()
+        dfa = self.get((minimal, canonical), build)
+        return relabel(dfa, dict(zip(canonical, word)))
+
+    def size(self, word):
+        """ Return the number of states of the minimal automaton of 
+        certain(word) """
+        canonical = words.canonical(word)
+        try:
+            size = self.sizes[canonical]
+            self.hits += 1
+        except KeyError:
+            size = len(Certain(canonical).minimal_automaton().states)
+            self.sizes[canonical] = size
+            self.misses += 1
+        return size
+
+
+AUTOMATA_CACHE = AutomataCache()
+
+
+def relabel(dfa, mapping):
+    """
+    Return a new automaton obtained from dfa, whose alphabet contains sets
+    of symbols, by renaming each symbol a into mapping[a]. 
+    """
+    alphabet = {}
+    for symbol in dfa.alphabet:
+        alphabet[frozenset([mapping[a] for a in symbol])] = symbol
+    table = {}
+    for q in dfa.states:
+        table[q] = dict([(symbol, dfa.delta(q, label)) for symbol, label 
+                                                    in alphabet.iteritems()])
+    delta = lambda q, a: table[q][a]
+    return Automata(dfa.states, alphabet.keys(), delta, dfa.start, dfa.accepts)
@@ -1,18 +1,30 @@
 #!/usr/bin/python
 
 import os
+import sequence
+import store
 import words
-from certain import Certain
+from certain import AUTOMATA_CACHE
 
 PATH_RESULTS = 'results'
 RESULT_SEP = '    '
 USE_GAP = False
+USE_STORE = False   # Persist minimal automata in PATH_STORE, see store.py
+PATH_STORE = os.path.join(PATH_RESULTS, 'automata.db')
 
 try:
     if USE_GAP:
         import automata_gap
 except ImportError as e:
     USE_GAP = False
+
+_store = None
+def get_store():
+    """ Return the (lazily opened) store of automata at PATH_STORE """
+    global _store
+    if _store is None:
+        _store = store.AutomataStore(PATH_STORE)
+    return _store
    
 """ Dear user, 
 I really need to warn you before you make use of the following code. This code
@@ -33,10 +45,10 @@ def size_of_minimal_dfa_for(w):
     if isinstance(w, str):
         if USE_GAP:
             return automata_gap.size_of_minDFA(w)            
+        elif USE_STORE:
+            return get_store().size(w)
         else:
-            dfa = Certain(w).automaton()
-            dfa.minimize()
-            return len(dfa.states)
+            return AUTOMATA_CACHE.size(w)
     else:
         raise TypeError, 'Argument type %s unsupported' % type(word)
 
@@ -80,10 +92,33 @@ def exp_exhaustive_for(alphabet, min_size, max_size, display = False):
     [word]RESULT_SEP[size]RESULT_SEP[n+x]RESULT_SEP[diff with upperbound]
     """
     filename = '%s_%d_%d.txt' % (alphabet, min_size, max_size)
-    iterable = words.words(alphabet, min_size, max_size)
+    iterable = indexed_words(alphabet, min_size, max_size)
+    if USE_STORE:
+        get_store().warm(indexed_words(alphabet, min_size, max_size))
     return exp_for(iterable, filename, display)
     
     
+def indexed_words(alphabet, min_size, max_size):
+    """
+    Return a generator of the words of words.words(alphabet, min_size, 
+    max_size), in the same order. The trie of words is walked depth-first,
+    and the KMP index of each word is derived from the one of its parent
+    (see sequence.PatternIndex.extend) and cached by sequence.pattern_index,
+    so that the construction of certain(w) reuses it. 
+    """
+    def walk(index, length):
+        if len(index) == length:
+            yield index.w
+        else:
+            for a in alphabet:
+                child = sequence.pattern_index(index.w + a, index)
+                for word in walk(child, length):
+                    yield word
+    for length in range(min_size, max_size + 1):
+        for word in walk(sequence.pattern_index(''), length):
+            yield word
+
+
 def exp_random_for(alphabet, number, min_size, max_size, display = False):
     """ 
     Run an experiment for [number] random words and save the results.
@@ -1,5 +1,8 @@
 #!/usr/bin/python
 
+import array
+import itertools
+import random
 import sequence
 
 class Multiword():
@@ -11,7 +14,7 @@ class Multiword():
     mw == mw2   - same content
     mw[i]       - get and set (work by copy)
     mw[i:j]     - (partial and total) slices supported
-    hash(mw)    - (experimental) hash method
+    hash(mw)    - (experimental) hash method, see FrozenMultiword
     for x in mw - natural iterator over sets of symbols
     mw * x      - classical exponentiation over words
     str(mw),repr(mw)    - pretty printable representation
@@ -28,9 +31,9 @@ class Multiword():
         if isinstance(param, str):
             for e in param:
                 self.content.append(set(e))
-        elif isinstance(param, Multiword):
+        elif isinstance(param, (Multiword, CompactMultiword)):
             for e in param:
-                self.content.append(e)
+                self.content.append(set(e))
         elif isinstance(param, list) or isinstance(param, tuple):
             m = Multiword()
             for word in param:
@@ -64,7 +67,7 @@ class Multiword():
         return str(self)
 
     def __eq__(self, other):
-        if isinstance(other, Multiword):
+        if isinstance(other, (Multiword, CompactMultiword)):
             if len(self) == len(other):
                 for i in range(len(self)):
                     if self[i] != other[i]:
@@ -78,7 +81,7 @@ class Multiword():
     def __add__(self, other):
         """ Add either a multiword or a word to the right """
         mw = Multiword()
-        if isinstance(other, Multiword) or isinstance(other, str):
+        if isinstance(other, (Multiword, CompactMultiword, str)):
             for el in self:
                 mw.append(el)
             for el in other:
@@ -122,9 +125,8 @@ class Multiword():
         if isinstance(other, set):
             return other in self.content
         elif isinstance(other, str):
-            seq = sequence.Sequence(self, other)
-            return len(seq.apply()) == 0
-        elif isinstance(other, Multiword):
+            return sequence.Sequence(self, other).run() == 0
+        elif isinstance(other, (Multiword, CompactMultiword)):
             if len(other) <= len(self):
                 for i in range(len(other)):
                     if other[i] != self[i]:
@@ -145,7 +147,7 @@ class Multiword():
     def __and__(self, other):
         """ Called with (m & o). Perform the union between the current
         and the other multiwords. Parameter can be a word too """
-        if isinstance(other, Multiword) or isinstance(other, str):
+        if isinstance(other, (Multiword, CompactMultiword, str)):
             mw = Multiword()
             for i in range(max(len(self), len(other))):
                 el = set()
@@ -163,7 +165,8 @@ class Multiword():
         Please note, as multiwords use lists and sets to store
         data, hash values can only be used if NO modifications are
         made AFTER on the multiword.
-        Otherwise, border effects certainly appear. """
+        Otherwise, border effects certainly appear. 
+        See FrozenMultiword for a safe and well-distributed hash. """
         return hash(''.join([list(i)[0] for i in self]))
 
     def __cmp__(self, other):
@@ -171,11 +174,75 @@ class Multiword():
         return len(self) - len(other)
 
     def words(self):
-        """ Return the set of every possible words of this multiword """
-        if len(self) == 1:
-            return [x for x in sorted(self[0])]
+        """ Return the list of every possible words of this multiword,
+        in lexicographic order """
+        return list(self.iterwords())
+
+    def iterwords(self):
+        """ Return a generator of the possible words of this multiword, 
+        in lexicographic order, without materializing them """
+        for word in itertools.product(*[sorted(el) for el in self]):
+            yield ''.join(word)
+
+    def count_words(self):
+        """ Return the number of possible words of this multiword """
+        count = 1
+        for el in self:
+            count = count * len(el)
+        return count
+
+    def sample_word(self, rand=random):
+        """ Return a possible word of this multiword, chosen uniformly
+        at random with given random generator """
+        return ''.join([rand.choice(sorted(el)) for el in self])
+
+    def rank_word(self, word):
+        """ Return the position of given possible word in words() """
+        if len(word) != len(self):
+            raise ValueError, '%s is not a possible word of %s' % (word, self)
+        rank = 0
+        for a, el in zip(word, self):
+            el = sorted(el)
+            if a not in el:
+                raise ValueError, '%s is not a possible word of %s' % (word, self)
+            rank = rank * len(el) + el.index(a)
+        return rank
+
+    def unrank_word(self, rank):
+        """ Return the possible word at given position in words() """
+        if not 0 <= rank < self.count_words():
+            raise IndexError, 'Rank %d out of range' % rank
+        word = []
+        for el in reversed(list(self)):
+            el = sorted(el)
+            rank, i = divmod(rank, len(el))
+            word.append(el[i])
+        return ''.join(reversed(word))
+
+    def certain_words(self, words):
+        """ Return the set of words of given iterable that are "sure" in 
+        this multiword, using a single multi-pattern pass """
+        return sequence.MultiSequence(self, words).certain()
+
+    def monitor(self, w):
+        """ Return a sequence.Monitor for w that has read this multiword,
+        to which new positions can be appended """
+        monitor = sequence.Monitor(w)
+        monitor.extend(self)
+        return monitor
+
+    def witness(self, w, smallest=False):
+        """ Return a possible word of this multiword in which w does not
+        occur (the lexicographically smallest one if smallest is True), 
+        or None if w is "sure" in this multiword """
+        if smallest:
+            return sequence.smallest_witness(self, w)
         else:
-            return [a + x for a in sorted(self[0]) for x in self[1:].words()]
+            return sequence.Sequence(self, w).witness()
+
+    def freeze(self):
+        """ Return an immutable (and hashable) copy of this multiword """
+        return FrozenMultiword(self)
 
     def append(self, el):
         """ Add a set of symbol to the right of the multiword.
@@ -185,24 +252,34 @@ class Multiword():
     def minimize(self, w):
         """ Return a new multiword which is obtained by
         removing first and last elements until w is not found. """
-        if w not in self:
-            raise Exception, 'Can\'t minimize: %s not in %s' % (w, self)
-        i, j = 0, len(self)
-        while w in self[i + 1:j]:
-            i = i + 1
-        while w in self[i:j-1]:
-            j = j - 1
+        i, j = self.minimal_window(w)
         return self[i:j]
 
     def isMinimal(self, w):
         """ Return true if current multiword coincide with the minimal
         one. """
-        return self == self.minimize(w)
+        return self.minimal_window(w) == (0, len(self))
+
+    def minimal_window(self, w):
+        """ Return the bounds (i, j) of the multiword returned by 
+        minimize(w), this is, of the last minimal certain window of w. """
+        window = None
+        for window in sequence.minimal_windows(self, w):
+            pass
+        if window is None:
+            raise Exception, 'Can\'t minimize: %s not in %s' % (w, self)
+        return window
+
+    def minimal_windows(self, w):
+        """ Return a generator of the bounds (i, j) of every minimal 
+        multiword self[i:j] in which w is certain. See 
+        sequence.minimal_windows. """
+        return sequence.minimal_windows(self, w)
 
     def startswith(self, other):
         """ Return true if current multiword starts with given
         word or multiword """
-        if isinstance(other, str) or isinstance(other, Multiword):
+        if isinstance(other, (str, Multiword, CompactMultiword)):
             if len(other) <= len(self):
                 for i in range(len(other)):
                     if other[i] != self[i]:
@@ -214,6 +291,302 @@ class Multiword():
             raise TypeError, 'Argument type %s unsupported' % type(other)
 
 
+class FrozenMultiword(Multiword):
+    """ Immutable multiwords. Positions are frozen sets stored in a tuple,
+    and the hash value is computed once from the whole content, so frozen
+    multiwords can safely be used as dict keys or set elements. Equality 
+    between frozen multiwords first compares identities and hash values. 
+    Operators building new multiwords (except slicing) return Multiword 
+    instances, use thaw() to get a mutable copy. """
+
+    def __init__(self, param=''):
+        """ Same parameters as Multiword """
+        Multiword.__init__(self, param)
+        self.content = tuple([frozenset(e) for e in self.content])
+        self._hash = hash(self.content)
+
+    def __eq__(self, other):
+        if self is other:
+            return True
+        elif isinstance(other, FrozenMultiword):
+            return self._hash == other._hash and self.content == other.content
+        else:
+            return Multiword.__eq__(self, other)
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return self._hash
+
+    def __setitem__(self, i, el):
+        raise TypeError, 'FrozenMultiword does not support item assignment'
+
+    def append(self, el):
+        raise TypeError, 'FrozenMultiword does not support append'
+
+    def __getslice__(self, i, j):
+        mw = FrozenMultiword()
+        mw.content = self.content[max(0, i):j]
+        mw._hash = hash(mw.content)
+        return mw
+
+    def freeze(self):
+        return self
+
+    def thaw(self):
+        """ Return a mutable copy of this multiword """
+        return Multiword(self)
+
+
+def _typecode(size):
+    """ Return the smallest array typecode whose items can hold a bitmask
+    over an alphabet of the given size, or None if no typecode fits """
+    for typecode in 'BHIL':
+        if size <= 8 * array.array(typecode).itemsize:
+            return typecode
+    return None
+
+
+class Alphabet(object):
+    """ Interning table mapping symbols to bit positions. A set of symbols
+    over the alphabet is encoded as an integer bitmask, bit i being set iff
+    the i-th interned symbol is in the set. """
+    __slots__ = ('symbols', 'index', 'decoded')
+
+    def __init__(self, symbols=''):
+        self.symbols = []
+        self.index = {}
+        self.decoded = {0: frozenset()}
+        for a in symbols:
+            self.intern(a)
+
+    def __len__(self):
+        return len(self.symbols)
+
+    def intern(self, symbol):
+        """ Return the bit position of symbol, interning it if needed """
+        try:
+            return self.index[symbol]
+        except KeyError:
+            self.index[symbol] = len(self.symbols)
+            self.symbols.append(symbol)
+            return self.index[symbol]
+
+    def encode(self, symbols, intern=True):
+        """ Return the bitmask of given set of symbols. If intern is False,
+        unknown symbols are not added and None is returned instead. """
+        mask = 0
+        for a in symbols:
+            if intern:
+                mask |= 1 << self.intern(a)
+            elif a in self.index:
+                mask |= 1 << self.index[a]
+            else:
+                return None
+        return mask
+
+    def decode(self, mask):
+        """ Return the (frozen and cached) set of symbols encoded by mask """
+        try:
+            return self.decoded[mask]
+        except KeyError:
+            el, rest = set(), mask
+            while rest:
+                low = rest & -rest
+                el.add(self.symbols[low.bit_length() - 1])
+                rest ^= low
+            self.decoded[mask] = frozenset(el)
+            return self.decoded[mask]
+
+
+ALPHABET = Alphabet()   # Alphabet shared by default by compact multiwords
+
+
+class CompactMultiword(object):
+    """ Memory-compact multiwords. Each position is stored as an integer
+    bitmask over an interned Alphabet, in an array buffer whose item size
+    is widened when the alphabet grows (or in a list for alphabets wider
+    than a machine word). Compact multiwords support the same operators as
+    Multiword and can be mixed with them. Multiwords sharing the same
+    alphabet are combined with bitwise operations only. """
+    __slots__ = ('alphabet', 'masks')
+
+    def __init__(self, param='', alphabet=None):
+        """ The parameter can be :
+         - a word
+         - a (compact) multiword
+         - a list of words
+         ... or nothing ! The alphabet defaults to ALPHABET. """
+        self.alphabet = ALPHABET if alphabet is None else alphabet
+        self.masks = array.array(_typecode(len(self.alphabet)) or 'L')
+        if isinstance(param, str):
+            self.extend_masks([1 << self.alphabet.intern(a) for a in param])
+        elif isinstance(param, CompactMultiword) and \
+                param.alphabet is self.alphabet:
+            self.extend_masks(param.masks)
+        elif isinstance(param, (Multiword, CompactMultiword)):
+            self.extend_masks([self.alphabet.encode(e) for e in param])
+        elif isinstance(param, list) or isinstance(param, tuple):
+            self.extend_masks(CompactMultiword.from_words(param,
+                                    self.alphabet).masks)
+        else:
+            raise TypeError, 'Argument type %s unsupported' % type(param)
+
+    @classmethod
+    def from_words(cls, words, alphabet=None):
+        """ Bulk constructor: return the union of given words, computed
+        position-wise on bitmasks in a single pass. """
+        mw = cls(alphabet=alphabet)
+        intern = mw.alphabet.intern
+        masks = []
+        for word in words:
+            for i, a in enumerate(word):
+                if i < len(masks):
+                    masks[i] |= 1 << intern(a)
+                else:
+                    masks.append(1 << intern(a))
+        mw.extend_masks(masks)
+        return mw
+
+    def extend_masks(self, masks):
+        """ Add given bitmasks (over self.alphabet) to the right """
+        self.fit()
+        if isinstance(self.masks, array.array) and \
+                getattr(masks, 'typecode', self.masks.typecode) != \
+                self.masks.typecode:
+            masks = masks.tolist()  # Buffer built before the alphabet grew
+        self.masks.extend(masks)
+
+    def fit(self):
+        """ Widen the buffer so that it can hold any bitmask over the
+        current alphabet """
+        size = len(self.alphabet)
+        if isinstance(self.masks, array.array) and \
+                size > 8 * self.masks.itemsize:
+            typecode = _typecode(size)
+            if typecode is None:
+                self.masks = list(self.masks)
+            else:
+                self.masks = array.array(typecode, self.masks)
+
+    def encode(self, other):
+        """ Return the list of bitmasks of a word or a multiword, wrt. the
+        alphabet of this multiword """
+        if isinstance(other, CompactMultiword) and \
+                other.alphabet is self.alphabet:
+            self.fit()
+            return other.masks
+        masks = [self.alphabet.encode(el) for el in other]
+        self.fit()
+        return masks
+
+    # Protocol-level methods only rely on len, indexing and slicing
+    __str__ = Multiword.__dict__['__str__']
+    __repr__ = Multiword.__dict__['__repr__']
+    __cmp__ = Multiword.__dict__['__cmp__']
+    words = Multiword.__dict__['words']
+    iterwords = Multiword.__dict__['iterwords']
+    count_words = Multiword.__dict__['count_words']
+    sample_word = Multiword.__dict__['sample_word']
+    rank_word = Multiword.__dict__['rank_word']
+    unrank_word = Multiword.__dict__['unrank_word']
+    minimize = Multiword.__dict__['minimize']
+    isMinimal = Multiword.__dict__['isMinimal']
+    minimal_window = Multiword.__dict__['minimal_window']
+    minimal_windows = Multiword.__dict__['minimal_windows']
+    startswith = Multiword.__dict__['startswith']
+    certain_words = Multiword.__dict__['certain_words']
+    monitor = Multiword.__dict__['monitor']
+    witness = Multiword.__dict__['witness']
+
+    def __eq__(self, other):
+        if isinstance(other, (Multiword, CompactMultiword)):
+            return len(self) == len(other) and \
+                    list(self.masks) == list(self.encode(other))
+        else:
+            raise TypeError, 'Argument must be a Multiword, not %s' % type(other)
+
+    def __ne__(self, other):
+        return not self == other
+
+    __hash__ = None     # Mutable, see FrozenMultiword
+
+    def __len__(self):
+        return len(self.masks)
+
+    def __getitem__(self, i):
+        """ Return a copy of the set at position i """
+        return set(self.alphabet.decode(self.masks[i]))
+
+    def __setitem__(self, i, el):
+        """ Set (the encoding of) el at position i """
+        mask = self.alphabet.encode(el)
+        self.fit()
+        self.masks[i] = mask
+
+    def __iter__(self):
+        """ Iterate over (frozen) sets of symbols """
+        decode = self.alphabet.decode
+        for mask in self.masks:
+            yield decode(mask)
+
+    def __getslice__(self, i, j):
+        mw = CompactMultiword(alphabet=self.alphabet)
+        mw.masks = self.masks[max(0, i):j]
+        return mw
+
+    def __add__(self, other):
+        """ Add either a multiword or a word to the right """
+        if isinstance(other, (Multiword, CompactMultiword, str)):
+            mw = self[:]
+            mw.extend_masks(self.encode(other))
+            return mw
+        else:
+            raise TypeError, 'Argument type %s unsupported' % type(other)
+
+    def __mul__(self, other):
+        if isinstance(other, int):
+            mw = self[:]
+            mw.masks = self.masks * max(0, other)
+            return mw
+        else:
+            raise TypeError, 'Argument type %s unsupported' % type(other)
+
+    def __and__(self, other):
+        """ Called with (m & o). Perform the union between the current
+        and the other multiwords. Parameter can be a word too """
+        if isinstance(other, (Multiword, CompactMultiword, str)):
+            masks = self.encode(other)
+            mw = self[:]
+            mw.fit()
+            if len(masks) > len(mw):
+                mw.extend_masks(masks[len(mw):])
+            for i in range(min(len(self), len(masks))):
+                mw.masks[i] |= masks[i]
+            return mw
+        else:
+            raise TypeError, 'Argument type %s unsupported' % type(other)
+
+    def __contains__(self, other):
+        """ Same semantics as Multiword.__contains__ """
+        if isinstance(other, set):
+            mask = self.alphabet.encode(other, intern=False)
+            return mask is not None and mask in self.masks
+        elif isinstance(other, str):
+            return sequence.Sequence(self, other).run() == 0
+        elif isinstance(other, (Multiword, CompactMultiword)):
+            masks = self.encode(other)
+            return len(masks) <= len(self) and \
+                    list(self.masks[:len(masks)]) == list(masks)
+        else:
+            raise TypeError, 'Argument type %s unsupported' % type(other)
+
+    def append(self, el):
+        """ Add (the encoding of) a set of symbols to the right """
+        self.extend_masks([self.alphabet.encode(el)])
+
+
 def multiword_from_word(w, shift = 0):
     """ Return a new multiword that is constructed from word 
     w, this is, {w_1}{w_2}{w_3}...
@@ -2,26 +2,23 @@
 
 class Sequence():
     """ Sequence construction in order to detect the "sure presence"
-    of a word w in a multiword m """
+    of a word w in a multiword m. The current set of prefixes is encoded
+    as an integer bitmask (see PatternIndex) in self.state, and decoded
+    on demand in self.S """
     
     def __init__(self, m, w):
         self.m = m
         self.w = w
+        self.index = pattern_index(w)
         self.i = 0
-        self.S = set([''])
+        self.state = self.index.start
         self.iterator = self.__iter__()
         self.returns_string = True
         
     def __iter__(self):
         while self.i < len(self.m):
             yield self.S 
-            self.S = set([sufpre(p+a, self.w) for p in self.S \
-                                         for a in self.m[self.i]])
-                                         
-            self.S = lower_bound(self.S, self.w)                             
-                                         
-            while self.w in self.S:
-                self.S.remove(self.w)
+            self.state = self.index.successor(self.state, self.m[self.i])
             self.i = self.i + 1
         yield self.S
         
@@ -36,9 +33,45 @@ class Sequence():
         
     def apply(self):
         """ Apply the sequence and return the last result """
-        for _ in self:
-            pass
+        self.run()
         return self.S
+
+    def run(self):
+        """ Apply the sequence and return the last (encoded) state. 
+        w is certain in m iff this state is 0. """
+        successor, state = self.index.successor, self.state
+        for i in range(self.i, len(self.m)):
+            state = successor(state, self.m[i])
+        self.i, self.state = max(self.i, len(self.m)), state
+        return state
+
+    def witness(self):
+        """ Apply the sequence from the beginning while keeping, for each
+        prefix of each step, a back-pointer to the prefix and the symbol 
+        it comes from. Return a possible word of m in which w does not 
+        occur, or None if w is certain in m. """
+        index, back = self.index, []
+        state = index.start
+        for el in self.m:
+            el = sorted(el)
+            pointers = {}
+            for k in index.lengths(state):
+                for a in el:
+                    pointers.setdefault(index.step(k, a), (k, a))
+            state = index.lower_bound(index.encode_lengths(pointers))
+            back.append(pointers)
+        if state == 0:
+            return None
+        k, word = index.lengths(state)[0], []
+        for pointers in reversed(back):
+            k, a = pointers[k]
+            word.append(a)
+        return ''.join(reversed(word))
+
+    @property
+    def S(self):
+        """ The current set of prefixes """
+        return self.index.decode(self.state)
         
     def __index__(self):
         return self.i    
@@ -50,6 +83,160 @@ class Sequence():
         return str(self)
 
 
+class MultiSequence():
+    """ Multi-pattern variant of the sequence construction, in order to 
+    detect in a single pass which words of a set are certain in a 
+    multiword m. The state maps Aho-Corasick nodes (see PatternSet) to the
+    bitmask of the words w such that the node is reached by some possible
+    word of the read prefix of m that avoids w. """
+
+    def __init__(self, m, words):
+        self.m = m
+        self.index = PatternSet(words)
+        self.i = 0
+        self.state = {0: self.index.all & ~self.index.out[0]}
+        if self.state[0] == 0:
+            self.state = {}
+
+    def run(self):
+        """ Apply the sequence and return the last state """
+        table, out = self.index.table, self.index.out
+        state = self.state
+        for i in range(self.i, len(self.m)):
+            if not state:
+                break
+            symbols = self.m[i]
+            n_state = {}
+            for node, mask in state.iteritems():
+                row = table[node]
+                for a in symbols:
+                    dest = row.get(a, 0)
+                    n_mask = mask & ~out[dest]
+                    if n_mask:
+                        n_state[dest] = n_state.get(dest, 0) | n_mask
+            state = n_state
+        self.i, self.state = max(self.i, len(self.m)), state
+        return state
+
+    def certain(self):
+        """ Apply the sequence and return the set of words that are 
+        certain in m """
+        avoided = 0
+        for mask in self.run().itervalues():
+            avoided |= mask
+        return set([w for k, w in enumerate(self.index.words) 
+                                        if not avoided & (1 << k)])
+
+    def __index__(self):
+        return self.i
+
+
+class Monitor():
+    """ Online variant of the sequence construction, for multiwords that 
+    grow one position at a time. Each appended position costs a single 
+    state transition (independently of the length of the history), and 
+    whether w is certain in the positions read so far is available at any 
+    time. Snapshots are plain tuples that can be stored and restored. """
+
+    def __init__(self, w):
+        self.w = w
+        self.index = pattern_index(w)
+        self.i = 0
+        self.state = self.index.start
+
+    def append(self, el):
+        """ Read a new position (a set of symbols) """
+        if self.state != 0:     # certainty is never lost
+            self.state = self.index.successor(self.state, el)
+        self.i = self.i + 1
+
+    def extend(self, m):
+        """ Read every position of given multiword """
+        for el in m:
+            self.append(el)
+
+    def is_certain(self):
+        """ Return true iff w is certain in the positions read so far """
+        return self.state == 0
+
+    def snapshot(self):
+        """ Return the current state as a (w, number of positions, state)
+        tuple """
+        return (self.w, self.i, self.state)
+
+    def restore(self, snapshot):
+        """ Restore a state returned by snapshot() """
+        w, i, state = snapshot
+        if w != self.w:
+            raise ValueError, 'Snapshot for %s cannot be restored for %s' % (w, self.w)
+        self.i, self.state = i, state
+
+    def __index__(self):
+        return self.i
+
+    def __str__(self):
+        return 'Step %d = {%s}' % (self.i, 
+                                ','.join(sorted(self.index.decode(self.state))))
+
+    def __repr__(self):
+        return str(self)
+
+
+def minimal_windows(m, w):
+    """ Return a generator of the minimal certain windows of w in m, this is,
+    of the pairs (i, j), by increasing i and j, such that w is certain in 
+    m[i:j] but neither in m[i+1:j] nor in m[i:j-1]. 
+
+    This is a single sweep over m. For the current end j, every start i is
+    mapped to the state reached by reading m[i:j]. Two starts reaching the 
+    same state behave the same afterwards, so only the largest one is kept, 
+    and the largest start reaching state 0 (certainty) is the only one 
+    that can make m[i:j] minimal. """
+    index = pattern_index(w)
+    starts = {}
+    last = -1
+    for j in range(len(m)):
+        starts[index.start] = j
+        n_starts = {}
+        for state, i in starts.iteritems():
+            dest = index.successor(state, m[j])
+            if n_starts.get(dest, -1) < i:
+                n_starts[dest] = i
+        starts = n_starts
+        if starts.get(0, -1) > last:
+            last = starts[0]
+            yield (last, j + 1)
+
+
+def smallest_witness(m, w):
+    """ Return the lexicographically smallest possible word of m in which w
+    does not occur, or None if w is certain in m. A backward pass computes,
+    for each position i, the (encoded) set of prefixes of w from which 
+    m[i:] can be read without completing w. A forward pass then chooses 
+    the smallest symbol that stays in these sets. """
+    index = pattern_index(w)
+    avoiding = [index.full - 1]
+    for el in reversed(list(m)):
+        state = 0
+        for k in range(len(w)):
+            for a in el:
+                if avoiding[-1] & (1 << index.step(k, a)) & ~index.full:
+                    state |= 1 << k
+                    break
+        avoiding.append(state)
+    avoiding.reverse()
+    if not avoiding[0] & 1:
+        return None
+    k, word = 0, []
+    for i, el in enumerate(m):
+        for a in sorted(el):
+            if avoiding[i + 1] & (1 << index.step(k, a)) & ~index.full:
+                k = index.step(k, a)
+                word.append(a)
+                break
+    return ''.join(word)
+
+
 def lower_bound(prefixes, w):
     """ Return the "lower bound" of a set of prefixes. This is, the minimal
     subset wrt. inclusion such that every element of prefixes has a suffix in
@@ -75,3 +262,228 @@ def sufpre(p, w):
             return p[i:]
     return ''
 
+
+class PatternIndex(object):
+    """ Knuth-Morris-Pratt index of a word w: its failure function and a
+    dense transition table such that step(k, a) is the length of
+    sufpre(w[:k] + a, w). The index is built once in O(|w|.|alphabet|)
+    and each step is then a table lookup. Symbols that do not occur in w
+    lead to the empty prefix. 
+
+    Sets of prefixes of w are encoded as integer bitmasks over prefix 
+    lengths: bit k is set iff w[:k] is in the set. borders[k] is the mask
+    of the proper suffixes of w[:k] that are prefixes of w, which drives 
+    the lower bound reduction. """
+
+    def __init__(self, w):
+        self.w = w
+        self.alphabet = sorted(set(w))
+        self.fail = failure(w)
+        self.table = [dict([(a, 0) for a in self.alphabet])]
+        if len(w) > 0:
+            self.table[0][w[0]] = 1
+        for k in range(1, len(w) + 1):
+            row = dict(self.table[self.fail[k]])
+            if k < len(w):
+                row[w[k]] = k + 1
+            self.table.append(row)
+        self.bits = [dict([(a, 1 << k) for a, k in row.iteritems()]) \
+                                                for row in self.table]
+        self.borders = [0]
+        for k in range(1, len(w) + 1):
+            self.borders.append((1 << self.fail[k]) | \
+                                            self.borders[self.fail[k]])
+        self.start = 1      # {''}
+        self.full = 1 << len(w)
+
+    def extend(self, a):
+        """ Return the PatternIndex of w + a, derived from this one in 
+        O(|w| + |alphabet|) (O(|w|.|alphabet|) if a is a new symbol): rows
+        of the tables for the proper prefixes of w are shared (only the 
+        lists that hold them are copied), and only the rows for w and w + a
+        are computed. """
+        n, w = len(self.w), self.w + a
+        index = PatternIndex.__new__(PatternIndex)
+        index.w = w
+        k = 0
+        if n > 0:
+            k = self.fail[n]
+            while k > 0 and a != w[k]:
+                k = self.fail[k]
+            if a == w[k]:
+                k = k + 1
+        index.fail = self.fail + [k]
+        if a in self.table[0]:
+            index.alphabet = self.alphabet
+            index.table = self.table[:n]
+            index.bits = self.bits[:n]
+        else:
+            index.alphabet = sorted(self.alphabet + [a])
+            index.table, index.bits = [], []
+            for k in range(n):
+                row = dict(self.table[k])
+                row[a] = 0
+                index.table.append(row)
+                row = dict(self.bits[k])
+                row[a] = 1
+                index.bits.append(row)
+        for k in (n, n + 1):
+            if k > 0:
+                row = dict(index.table[index.fail[k]])
+            else:
+                row = dict.fromkeys(index.alphabet, 0)
+            if k < len(w):
+                row[w[k]] = k + 1
+            index.table.append(row)
+            index.bits.append(dict([(b, 1 << j) for b, j in row.iteritems()]))
+        index.borders = self.borders + [(1 << index.fail[n + 1]) | 
+                                        self.borders[index.fail[n + 1]]]
+        index.start = 1
+        index.full = 1 << len(w)
+        return index
+
+    def step(self, k, a):
+        """ Return the length of the maximal suffix of w[:k] + a which is
+        also a prefix of w """
+        return self.table[k].get(a, 0)
+
+    def successor(self, state, symbols):
+        """ Return the lower bound of the set of prefixes reachable from
+        (encoded) state by reading any symbol of symbols """
+        n_state = 0
+        for row in self.rows(state):
+            for a in symbols:
+                n_state |= row.get(a, 1)
+        return self.lower_bound(n_state)
+
+    def normalize(self, symbols):
+        """ Return a frozen set of symbols that behaves as symbols wrt. w: 
+        symbols that do not occur in w are all replaced by None """
+        return frozenset([a if a in self.table[0] else None for a in symbols])
+
+    def rows(self, state):
+        """ Return the rows of self.bits of the prefixes in state """
+        rows = []
+        while state:
+            low = state & -state
+            rows.append(self.bits[low.bit_length() - 1])
+            state ^= low
+        return rows
+
+    def lower_bound(self, state):
+        """ Encoded counterpart of lower_bound(prefixes, w): drop w and 
+        every prefix that has another element of state as a suffix """
+        state &= ~self.full
+        rest, n_state = state, state
+        while rest:
+            low = rest & -rest
+            if state & self.borders[low.bit_length() - 1]:
+                n_state ^= low
+            rest ^= low
+        return n_state
+
+    def encode(self, prefixes):
+        """ Return the bitmask of a set of prefixes of w """
+        state = 0
+        for p in prefixes:
+            state |= 1 << len(p)
+        return state
+
+    def lengths(self, state):
+        """ Return the increasing list of the prefix lengths in state """
+        lengths = []
+        while state:
+            low = state & -state
+            lengths.append(low.bit_length() - 1)
+            state ^= low
+        return lengths
+
+    def encode_lengths(self, lengths):
+        """ Return the state of given prefix lengths """
+        state = 0
+        for k in lengths:
+            state |= 1 << k
+        return state
+
+    def decode(self, state):
+        """ Return the set of prefixes of w encoded by state """
+        prefixes = set()
+        while state:
+            low = state & -state
+            prefixes.add(self.w[:low.bit_length() - 1])
+            state ^= low
+        return prefixes
+
+    def __len__(self):
+        return len(self.w)
+
+
+def failure(w):
+    """ Return the KMP failure function of w as a list f such that f[k] is
+    the length of the longest proper border of w[:k] (f[0] = 0). """
+    f = [0] * (len(w) + 1)
+    k = 0
+    for i in range(1, len(w)):
+        while k > 0 and w[i] != w[k]:
+            k = f[k]
+        if w[i] == w[k]:
+            k = k + 1
+        f[i + 1] = k
+    return f
+
+
+INDEX_CACHE_SIZE = 1024
+_indexes = {}
+
+def pattern_index(w, parent=None):
+    """ Return the (shared and cached) PatternIndex for w. If it has to 
+    be built and parent, the PatternIndex of w[:-1], is given, the index
+    is derived from parent. """
+    try:
+        return _indexes[w]
+    except KeyError:
+        if len(_indexes) >= INDEX_CACHE_SIZE:
+            _indexes.clear()
+        if parent is not None and parent.w == w[:-1] and len(w) > 0:
+            _indexes[w] = parent.extend(w[-1])
+        else:
+            _indexes[w] = PatternIndex(w)
+        return _indexes[w]
+
+
+class PatternSet(object):
+    """ Aho-Corasick index of a set of words. Nodes are the prefixes of 
+    the words, node 0 being the empty prefix. table[v][a] is the node of 
+    the longest suffix of v + a that is a prefix of some word (symbols 
+    that are missing lead to node 0), and out[v] is the bitmask of the 
+    words (numbered as in self.words) that are suffixes of v. """
+
+    def __init__(self, words):
+        self.words = sorted(set(words))
+        self.all = (1 << len(self.words)) - 1
+        goto, self.out = [{}], [0]
+        for k, w in enumerate(self.words):
+            node = 0
+            for a in w:
+                if a not in goto[node]:
+                    goto[node][a] = len(goto)
+                    goto.append({})
+                    self.out.append(0)
+                node = goto[node][a]
+            self.out[node] |= 1 << k
+        # Breadth-first completion of goto along failure links
+        self.table = [dict(goto[0])]
+        self.table.extend([None] * (len(goto) - 1))
+        fail = [0] * len(goto)
+        queue = list(goto[0].values())
+        for node in queue:
+            self.out[node] |= self.out[fail[node]]
+            row = dict(self.table[fail[node]])
+            for a, child in goto[node].iteritems():
+                fail[child] = self.table[fail[node]].get(a, 0)
+                row[a] = child
+                queue.append(child)
+            self.table[node] = row
+
+    def __len__(self):
+        return len(self.words)
@@ -0,0 +1,167 @@
+#!/usr/bin/python
+
+"""
+Module that provides a persistent, file-backed store of compiled 
+certain(w) automata, so that they are not rebuilt across sessions and 
+processes. 
+
+The store is a SQLite database (in WAL mode, so that many processes can 
+read it while one writes). Each automaton is stored as flat int32 arrays 
+(transition table and accepting states), keyed by the word, the alphabet 
+and whether the automaton is minimal. Automata are only loaded when they 
+are requested, and the transition table is used in place of the fetched 
+buffer when numpy is available. Sizes only read the number of states. As 
+in certain.AutomataCache, words that are obtained from each other by a 
+permutation of symbols share the automaton of their canonical 
+representative (see words.canonical) for sizes and warming. 
+"""
+
+import array
+import ast
+import sqlite3
+import words
+
+from automata import Automata
+from certain import Certain
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+SCHEMA = """CREATE TABLE IF NOT EXISTS automata (
+    word TEXT NOT NULL,
+    alphabet TEXT NOT NULL,
+    minimal INTEGER NOT NULL,
+    states INTEGER NOT NULL,
+    start INTEGER NOT NULL,
+    accepts BLOB NOT NULL,
+    transitions BLOB NOT NULL,
+    PRIMARY KEY (word, alphabet, minimal))"""
+
+
+def alphabet_key(alphabet):
+    """ Return the key of an alphabet of sets of symbols. Its symbols, in 
+    the order of the key, number the columns of the stored tables. """
+    return repr(sorted([tuple(sorted(symbol)) for symbol in alphabet]))
+
+
+def to_array(blob):
+    """ Return the int32 array stored in given blob """
+    if numpy is not None:
+        return numpy.frombuffer(blob, dtype=numpy.int32)
+    table = array.array('i')
+    table.fromstring(str(blob))
+    return table
+
+
+class AutomataStore(object):
+    """ 
+    File-backed store of certain(w) automata whose states are 0..n-1 (as 
+    built by Certain.automaton and Certain.minimal_automaton). 
+    """
+
+    def __init__(self, path, timeout=60):
+        self.path = path
+        self.connection = sqlite3.connect(path, timeout=timeout)
+        self.connection.text_factory = str
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute(SCHEMA)
+        self.connection.commit()
+
+    def close(self):
+        self.connection.close()
+
+    def __contains__(self, key):
+        """ key is a word, or a (word, minimal) pair """
+        word, minimal = key if isinstance(key, tuple) else (key, True)
+        alphabet = alphabet_key(Certain(word).powerset_alphabet())
+        return self.connection.execute(
+            'SELECT 1 FROM automata WHERE word=? AND alphabet=? AND minimal=?',
+            (word, alphabet, int(minimal))).fetchone() is not None
+
+    def put(self, word, dfa, minimal=True, commit=True):
+        """ Store dfa as the (minimal if minimal) automaton of certain(word).
+        An automaton already stored for the same key is kept. """
+        key = alphabet_key(dfa.alphabet)
+        symbols = [frozenset(symbol) for symbol in ast.literal_eval(key)]
+        states = sorted(dfa.states)
+        if states != range(len(states)):
+            raise ValueError, 'States must be 0..n-1'
+        transitions = array.array('i', [dfa.delta(q, symbol) 
+                                        for q in states for symbol in symbols])
+        accepts = array.array('i', sorted(dfa.accepts))
+        self.connection.execute(
+            'INSERT OR IGNORE INTO automata VALUES (?, ?, ?, ?, ?, ?, ?)',
+            (word, key, int(minimal), len(states), dfa.start, 
+             sqlite3.Binary(accepts.tostring()), 
+             sqlite3.Binary(transitions.tostring())))
+        if commit:
+            self.connection.commit()
+
+    def get(self, word, minimal=True, alphabet=None):
+        """ Return the stored automaton of certain(word) over given alphabet
+        (see Certain.automaton), or None if it is not stored. """
+        key = alphabet_key(Certain(word).powerset_alphabet(alphabet))
+        row = self.connection.execute(
+            'SELECT states, start, accepts, transitions FROM automata '
+            'WHERE word=? AND alphabet=? AND minimal=?',
+            (word, key, int(minimal))).fetchone()
+        if row is None:
+            return None
+        states, start, accepts, transitions = row
+        symbols = [frozenset(symbol) for symbol in ast.literal_eval(key)]
+        symbol_ids = dict([(a, i) for i, a in enumerate(symbols)])
+        table = to_array(transitions)
+        width = len(symbols)
+        delta = lambda q, a: int(table[q * width + symbol_ids[a]])
+        return Automata(range(states), symbols, delta, start, 
+                        list(to_array(accepts)))
+
+    def automaton(self, word, minimal=True, alphabet=None):
+        """ Return the automaton of certain(word), building and storing it
+        if needed """
+        dfa = self.get(word, minimal, alphabet)
+        if dfa is None:
+            if minimal:
+                dfa = Certain(word).minimal_automaton(alphabet)
+            else:
+                dfa = Certain(word).automaton(alphabet)
+            self.put(word, dfa, minimal)
+        return dfa
+
+    def size(self, word):
+        """ Return the number of states of the minimal automaton of 
+        certain(word), building and storing the automaton of the canonical
+        representative of word if needed """
+        canonical = words.canonical(word)
+        key = alphabet_key(Certain(canonical).powerset_alphabet())
+        row = self.connection.execute(
+            'SELECT states FROM automata '
+            'WHERE word=? AND alphabet=? AND minimal=1',
+            (canonical, key)).fetchone()
+        if row is None:
+            return len(self.automaton(canonical).states)
+        return row[0]
+
+    def warm(self, iterable, minimal=True):
+        """ Build and store the automata of the canonical representatives 
+        of the given words that are not stored yet. Return the number of 
+        automata that were built. """
+        built = 0
+        seen = set()
+        for word in iterable:
+            canonical = words.canonical(word)
+            if canonical in seen:
+                continue
+            seen.add(canonical)
+            if (canonical, minimal) not in self:
+                if minimal:
+                    dfa = Certain(canonical).minimal_automaton()
+                else:
+                    dfa = Certain(canonical).automaton()
+                self.put(canonical, dfa, minimal, commit=False)
+                built += 1
+        self.connection.commit()
+        return built
@@ -2,6 +2,7 @@
 
 import random
 import itertools
+import string
 
 # ######## Words generators
 
@@ -128,6 +129,16 @@ def uniquify(word, sigma = None):
         output.append(corresp[a])
     return ''.join(output)
 
+
+CANONICAL_SIGMA = string.ascii_lowercase + ''.join([chr(i) for i in range(256)
+                                    if chr(i) not in string.ascii_lowercase])
+
+def canonical(word):
+    """ Return the representative of word under permutations of symbols,
+    this is, its uniquified representation over CANONICAL_SIGMA (whose 
+    first symbols are a, b, c, ...). """
+    return uniquify(word, CANONICAL_SIGMA)
+
     
 def uniquify_all(words, sigma = None):
     """ Return a list that contains the uniquified representation of